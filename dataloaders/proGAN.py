@@ -8,6 +8,25 @@ from ..dataloaders import ImageFolder
 from .image_folder import make_dataset
 from torchvision.utils import save_image
 
+class PyramidImageFolder(th.utils.data.Dataset):
+    def __init__(self, dataset):
+        """
+        wraps a prescaled ImageFolder to also yield the prior-resolution fade-in target,
+        so the 2x pool + upsample runs in the loader workers instead of the training loop
+        :param dataset: dataset serving images at the current training resolution
+        """
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        img = self.dataset[index]
+        prior = th.nn.functional.interpolate(
+            th.nn.functional.avg_pool2d(img.unsqueeze(0), 2), scale_factor=2).squeeze(0)
+        return img, prior
+
+    def __len__(self):
+        return len(self.dataset)
+
+
 class ProGANDataLoader(BaseDataLoader):
     def __init__(self, prescaled_data=True, prescaled_data_path=None, **kwargs):
         """
@@ -22,6 +41,31 @@ class ProGANDataLoader(BaseDataLoader):
 
     
     def get_batch_sizes(self, model):
+        # under DDP every backward issues collectives, so ranks probing at different
+        # batch sizes would desequence NCCL and hang. rank 0 probes alone with
+        # gradient sync off, shares its result, and re-broadcasts the weights its
+        # probe steps touched so the replicas start from identical parameters
+        distributed = th.distributed.is_available() and th.distributed.is_initialized()
+        if not distributed:
+            return self._probe_batch_sizes(model)
+
+        batch_sizes = None
+        if model.rank == 0:
+            with model.G.no_sync(), model.D.no_sync():
+                batch_sizes = self._probe_batch_sizes(model)
+        holder = [batch_sizes]
+        th.distributed.broadcast_object_list(holder, src=0)
+        batch_sizes = holder[0]
+        for net in (model.G, model.D):
+            for p in net.parameters():
+                th.distributed.broadcast(p.data, src=0)
+        if model.use_ema:
+            for p in model.G_shadow.values():
+                th.distributed.broadcast(p, src=0)
+        return batch_sizes
+
+
+    def _probe_batch_sizes(self, model):
         print("Calculating maximum batch sizes...")
         batch_sizes = dict()
         batch_size = 512
@@ -49,8 +93,18 @@ class ProGANDataLoader(BaseDataLoader):
 
     def set_batch_size(self, current_res, new_val):
         if self.prescaled_data:
-            self.dataset = ImageFolder(data_path=self.data_path+"/%s"%current_res, transform=tn.ToTensor())
-        self.dataloader = th.utils.data.DataLoader(self.dataset, batch_size=new_val, shuffle=True, num_workers=3)
+            self.dataset = PyramidImageFolder(
+                ImageFolder(data_path=self.data_path+"/%s"%current_res, transform=tn.ToTensor()))
+        # under distributed training each rank only reads its own shard of the dataset
+        self.sampler = None
+        if th.distributed.is_available() and th.distributed.is_initialized():
+            self.sampler = th.utils.data.distributed.DistributedSampler(self.dataset)
+        # pinned host memory lets the training loop overlap H2D copies with compute
+        self.dataloader = th.utils.data.DataLoader(self.dataset, batch_size=new_val,
+                                                   shuffle=self.sampler is None,
+                                                   sampler=self.sampler, num_workers=4,
+                                                   pin_memory=True, persistent_workers=True,
+                                                   prefetch_factor=4)
 
 
     def generate_prescaled_dataset(self, sizes):
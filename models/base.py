@@ -32,6 +32,14 @@ class BaseModel(th.nn.Module):
         self.gpu = gpu
 
 
+    # strip torch.compile and data-parallel wrappers so state dict keys match the bare module
+    def unwrap_network(self, net):
+        net = getattr(net, '_orig_mod', net)
+        if isinstance(net, (th.nn.DataParallel, th.nn.parallel.DistributedDataParallel)):
+            net = net.module
+        return net
+
+
     # save network to file
     def save_networks(self, epoch):
         for model_name in self.model_names:
@@ -39,9 +47,10 @@ class BaseModel(th.nn.Module):
                 save_filename = '%s_%s_net_%s.pth' % (self.name, epoch, model_name)
                 save_path = os.path.join(self.save_dir, save_filename)
                 net = getattr(self, model_name)
+                net = self.unwrap_network(net)
                 if th.cuda.is_available() and not 'optim' in model_name:
-                    th.save(net.module.cpu().state_dict(), save_path)
-                    net.module.to(self.device)
+                    th.save(net.cpu().state_dict(), save_path)
+                    net.to(self.device)
                 else:
                     th.save(net.state_dict(), save_path)
 
@@ -55,8 +64,7 @@ class BaseModel(th.nn.Module):
                 load_filename = '%s_%s_net_%s.pth' % (self.name, epoch, model_name)
             load_path = os.path.join(self.save_dir, load_filename)
             net = getattr(self, model_name)
-            if isinstance(net, th.nn.DataParallel):
-                net = net.module
+            net = self.unwrap_network(net)
             print('loading the model from %s' % load_path)
             state_dict = th.load(load_path, map_location=self.device)
             if hasattr(state_dict, '_metadata'):
@@ -9,6 +9,7 @@ from ..dataloaders.pix2pix import *
 from .base import BaseModel
 from ..networks.generators import MultiscaleGenerator
 from ..networks.discriminators import MultiscaleDiscriminator
+from ..networks.losses import MODE_CAPTURE, MODE_LOSS
 
 class Pix2Pix(BaseModel):
     def __init__(self, input_nc=3, output_nc=3, ngf=32, ndf=32, subnet_G='resnet', unet_downs=8,
@@ -240,11 +241,11 @@ class Pix2Pix(BaseModel):
 
         if not self.no_vgg:
             for mod in self.vgg_features:
-                mod.mode = 'capture'
+                mod.mode = MODE_CAPTURE
             self.vgg(real_B)
-            
+
             for mod in self.vgg_features:
-                mod.mode = 'loss'
+                mod.mode = MODE_LOSS
             self.vgg(fake_B)
 
             loss_G_VGG = 0
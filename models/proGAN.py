@@ -1,13 +1,13 @@
-import time, timeit, datetime, os, math, copy
-from itertools import accumulate
+import time, datetime, os, math
 import numpy as np
 import torch as th
-from torch.nn import AvgPool2d, DataParallel
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim import Adam
 import torchvision as tv
 from torchvision.utils import save_image
 import torchvision.transforms as tn
-from torch.nn.functional import interpolate
+from torch.nn.functional import avg_pool2d, interpolate
 from .base import BaseModel
 from ..dataloaders.proGAN import ProGANDataLoader
 from ..networks.generators import ProGrowGenerator as Generator
@@ -20,7 +20,7 @@ class ProGAN(BaseModel):
 
     def __init__(self, depth=7, latent_size=256, num_channels=3, learning_rate=1e-3, beta_1=0,
                  beta_2=0.99, eps=1e-8, drift=0.001, use_eql=True, use_ema=True, ema_decay=0.999,
-                 checkpoint=None, **kwargs):
+                 use_compile=False, checkpoint=None, **kwargs):
         """
         constructor for the class ProGAN, extends BaseModel
         :param depth: depth of the GAN, 2^depth is the final size of generated images
@@ -31,6 +31,9 @@ class ProGAN(BaseModel):
         :param use_eql: whether to use equalized learning rate
         :param use_ema: boolean for whether to use exponential moving averages
         :param ema_decay: value of mu for ema
+        :param use_compile: whether to compile the networks with torch.compile. Kernels are
+                            fused per shape, so expect a warmup at the start of each depth
+                            stage that amortizes over the steps at that resolution
         :param checkpoint: generator checkpoint to load for inference
         :param learning_rate: base learning rate for Adam
         :param beta_1: beta_1 parameter for Adam
@@ -39,6 +42,13 @@ class ProGAN(BaseModel):
         """
         super(ProGAN, self).__init__(**kwargs)
 
+        # TF32 tensor cores roughly halve fp32 conv/matmul latency on Ampere+ with
+        # negligible quality impact for GAN training; shape-static depth stages make
+        # the cudnn autotuner (enabled via BaseModel's auto_benchmark) a free win too
+        if self.device == th.device("cuda"):
+            th.backends.cuda.matmul.allow_tf32 = True
+            th.backends.cudnn.allow_tf32 = True
+
         # state of the object
         self.latent_size = latent_size
         self.num_channels = num_channels
@@ -48,28 +58,63 @@ class ProGAN(BaseModel):
         self.use_eql = use_eql
         self.drift = drift
         self.dataloader = None
+        self.reuse_fakes = False
 
         # Create the Generator and the Discriminator
         self.G = Generator(self.depth, self.latent_size, use_eql=self.use_eql).to(self.device)
         self.D = Discriminator(self.depth, self.latent_size, use_eql=self.use_eql).to(self.device)
 
-        # if code is to be run on GPU, we can use DataParallel:
+        # NHWC (channels-last) activations hit cuDNN's fastest fp16 conv kernels and
+        # propagate through the conv/interpolate/pool ops used here
         if self.device == th.device("cuda"):
-            self.G = DataParallel(self.G)
-            self.D = DataParallel(self.D)
+            self.G = self.G.to(memory_format=th.channels_last)
+            self.D = self.D.to(memory_format=th.channels_last)
+
+        # under a torchrun launch we use DistributedDataParallel; a plain single-process
+        # run (including inference-only construction) skips the process group entirely
+        # so building the model has no collective side effects
+        self.rank = 0
+        if self.device == th.device("cuda") and \
+           (dist.is_initialized() or "RANK" in os.environ or "WORLD_SIZE" in os.environ):
+            if not dist.is_initialized():
+                dist.init_process_group(backend="nccl")
+            self.rank = dist.get_rank()
+            local_rank = int(os.environ.get("LOCAL_RANK", 0))
+            th.cuda.set_device(local_rank)
+            # progressive growing only runs layers[:depth] and two rgb converters per
+            # forward, so the reducer has to tolerate unused parameters every step
+            self.G = DistributedDataParallel(self.G.to(local_rank), device_ids=[local_rank],
+                                             find_unused_parameters=True)
+            self.D = DistributedDataParallel(self.D.to(local_rank), device_ids=[local_rank],
+                                             find_unused_parameters=True)
+
+        # optionally compile the networks for kernel fusion and less Python overhead.
+        # dynamic is left at the default: the fade-in alpha is a Python float with a
+        # new value every epoch, and dynamic=False would specialize on each value
+        # until the recompile cache limit forces a permanent fall back to eager
+        if use_compile and hasattr(th, "compile"):
+            self.G = th.compile(self.G, mode="max-autotune")
+            self.D = th.compile(self.D, mode="max-autotune")
 
         # define the optimizers for the discriminator and generator
         self.default_rate = learning_rate
         self.G_optim = Adam(self.G.parameters(), lr=learning_rate, betas=(beta_1, beta_2), eps=eps)
         self.D_optim = Adam(self.D.parameters(), lr=learning_rate, betas=(beta_1, beta_2), eps=eps)
 
+        # mixed precision: run forward passes in fp16 on tensor cores, scale losses to
+        # avoid fp16 gradient underflow (master weights and EMA shadow stay in fp32)
+        self.use_amp = self.device == th.device("cuda")
+        self.scaler_G = th.cuda.amp.GradScaler(enabled=self.use_amp)
+        self.scaler_D = th.cuda.amp.GradScaler(enabled=self.use_amp)
+
         # setup the ema for the generator
+        self._ema_params = {}
         if self.use_ema:
-            # create a shadow copy of the generator
-            self.G_shadow = copy.deepcopy(self.G)
-
-            # initialize the G_shadow weights equal to the weights of G
-            self.update_average(self.G_shadow, self.G, beta=0)
+            # the shadow only needs the parameter tensors, a deepcopy of the whole module
+            # tree would double the non-parameter state for nothing. kept in fp32 so the
+            # average stays precise under mixed precision
+            G = self.G.module if isinstance(self.G, DistributedDataParallel) else self.G
+            self.G_shadow = {n: p.detach().clone().float() for n, p in G.named_parameters()}
 
         if checkpoint is not None:
             self.model_names = ['G']
@@ -104,28 +149,34 @@ class ProGAN(BaseModel):
 
 
     # This function updates the exponential average weights based on the current training
-    def update_average(self, model_tgt, model_src, beta):
+    def update_average(self, params_tgt, model_src, beta):
         """
-        update the target model using exponential moving averages
-        :param model_tgt: target model
+        update the target parameters using exponential moving averages
+        :param params_tgt: dict of target parameter tensors keyed by parameter name
         :param model_src: source model
         :param beta: value of decay beta
-        :return: None (updates the target model)
+        :return: None (updates the target parameters)
         """
-        # turn off gradient calculation
-        self.set_requires_grad(model_tgt, False)
-        self.set_requires_grad(model_src, False)
-
-        param_dict_src = dict(model_src.named_parameters())
-
-        for p_name, p_tgt in model_tgt.named_parameters():
-            p_src = param_dict_src[p_name]
-            assert (p_src is not p_tgt)
-            p_tgt.copy_(beta * p_tgt + (1. - beta) * p_src)
-
-        # turn back on the gradient calculation
-        self.set_requires_grad(model_tgt, True)
-        self.set_requires_grad(model_src, True)
+        # only average over the wrapped module so the shadow copy is not synced across ranks
+        if isinstance(model_src, DistributedDataParallel):
+            model_src = model_src.module
+
+        # gather the parameter lists once per pair, so every update is two batched
+        # kernel dispatches instead of one launch per parameter
+        cache_key = (id(params_tgt), id(model_src))
+        if cache_key not in self._ema_params:
+            tgt_list, src_list = [], []
+            for p_name, p_src in model_src.named_parameters():
+                p_tgt = params_tgt[p_name]
+                assert (p_src is not p_tgt)
+                tgt_list.append(p_tgt)
+                src_list.append(p_src)
+            self._ema_params[cache_key] = (tgt_list, src_list)
+        tgt_list, src_list = self._ema_params[cache_key]
+
+        with th.no_grad():
+            th._foreach_mul_(tgt_list, beta)
+            th._foreach_add_(tgt_list, src_list, alpha=1. - beta)
 
 
     def forward(self, real_A):
@@ -133,69 +184,106 @@ class ProGAN(BaseModel):
 
 
     def optimize_D(self, noise, real_batch, depth, alpha):
-        self.set_requires_grad(self.G, False)
-        self.set_requires_grad(self.D, True)
-
-        # downsample the real_batch for the given depth
-        down_sample_factor = int(np.power(2, self.depth - depth - 1)) if not self.dataloader.prescaled_data else 1
-        prior_downsample_factor = max(int(np.power(2, self.depth - depth)), 0) if not self.dataloader.prescaled_data else 2
+        # downsample the real_batch for the given depth (computed once and reused for all
+        # critic iterations); a pyramid-serving dataloader hands us both resolutions
+        # precomputed, otherwise only the prior-resolution branch needs a 2x pool on
+        # prescaled data
+        if isinstance(real_batch, (list, tuple)):
+            ds_real_samples, prior_ds_real_samples = real_batch
+            if depth == 0:
+                prior_ds_real_samples = ds_real_samples
+        else:
+            if self.dataloader.prescaled_data:
+                ds_real_samples = real_batch
+                prior_downsample_factor = 2
+            else:
+                down_sample_factor = 1 << (self.depth - depth - 1)
+                prior_downsample_factor = 1 << (self.depth - depth)
+                ds_real_samples = avg_pool2d(real_batch, down_sample_factor)
 
-        ds_real_samples = AvgPool2d(down_sample_factor)(real_batch)
+            if depth > 0:
+                prior_ds_real_samples = interpolate(avg_pool2d(real_batch, prior_downsample_factor), scale_factor=2)
+            else:
+                prior_ds_real_samples = ds_real_samples
 
-        if depth > 0:
-            prior_ds_real_samples = interpolate(AvgPool2d(prior_downsample_factor)(real_batch), scale_factor=2)
-        else:
-            prior_ds_real_samples = ds_real_samples
+        # match the networks' channels-last layout so the convs skip an implicit transpose
+        if self.device == th.device("cuda"):
+            ds_real_samples = ds_real_samples.to(memory_format=th.channels_last, non_blocking=True)
+            prior_ds_real_samples = prior_ds_real_samples.to(memory_format=th.channels_last, non_blocking=True)
 
         # real samples are a combination of ds_real_samples and prior_ds_real_samples
         real_samples = (alpha * ds_real_samples) + ((1 - alpha) * prior_ds_real_samples)
 
-        loss_val = 0
+        # losses that differentiate through the discriminator inside loss_D — R1's
+        # internal backward and WGAN-GP's double-backward gradient penalty — run
+        # without the scaler, so their unscaled fp16 gradients would underflow.
+        # keep those branches in fp32
+        use_amp = self.use_amp and not isinstance(self.loss, R1Regularized) \
+                  and not (isinstance(self.loss, WGAN_GP) and self.loss.use_gp)
+
+        # accumulate the loss as a GPU scalar, a .item() here would force a sync per step
+        loss_val = th.zeros((), device=self.device)
         for _ in range(self.n_critic):
             # optimize discriminator
             self.D_optim.zero_grad()
 
-            # generate a batch of samples
-            fake_samples = self.G(noise, depth, alpha).detach()
-
-            loss = self.loss.loss_D(real_samples.requires_grad_(), fake_samples.requires_grad_(), depth=depth, alpha=alpha)
-
-            if not isinstance(self.loss, R1Regularized):
-                loss.backward()
+            # generate a batch of samples, keeping the generator graph alive when the
+            # fake batch is reused for the generator step afterwards; otherwise no_grad
+            # freezes the generator side without walking its parameters
+            with th.cuda.amp.autocast(enabled=use_amp):
+                if self.reuse_fakes:
+                    fake_samples = self.G(noise, depth, alpha)
+                else:
+                    with th.no_grad():
+                        fake_samples = self.G(noise, depth, alpha)
 
-            self.D_optim.step()
+                loss = self.loss.loss_D(real_samples.requires_grad_(), fake_samples.detach().requires_grad_(), depth=depth, alpha=alpha)
 
-            loss_val += loss.item()
+            if isinstance(self.loss, R1Regularized):
+                # already backwarded internally in fp32, just step
+                self.D_optim.step()
+            else:
+                self.scaler_D.scale(loss).backward()
+                self.scaler_D.unscale_(self.D_optim)
+                self.scaler_D.step(self.D_optim)
+                self.scaler_D.update()
 
-        return loss_val / self.n_critic
+            loss_val += loss.detach()
 
+        return loss_val / self.n_critic, fake_samples if self.reuse_fakes else None
 
-    def optimize_G(self, noise, real_batch, depth, alpha):
-        self.set_requires_grad(self.G, True)
-        self.set_requires_grad(self.D, False)
 
-        # optimize the generator
+    def optimize_G(self, noise, real_batch, depth, alpha, fake_samples=None):
+        # optimize the generator; the discriminator isn't frozen here — its gradients
+        # from this backward are simply discarded by D_optim.zero_grad() next step,
+        # which is cheaper than toggling requires_grad on every parameter each batch
         self.G_optim.zero_grad()
 
-        fake_samples = self.G(noise, depth, alpha)
+        with th.cuda.amp.autocast(enabled=self.use_amp):
+            # reuse the fake batch from the discriminator step if it is still attached to
+            # the generator graph (G's parameters haven't changed in between)
+            if fake_samples is None:
+                fake_samples = self.G(noise, depth, alpha)
 
-        loss = self.loss.loss_G(real_batch, fake_samples, depth=depth, alpha=alpha)
-        loss.backward()
+            loss = self.loss.loss_G(real_batch, fake_samples, depth=depth, alpha=alpha)
 
-        self.G_optim.step()
+        self.scaler_G.scale(loss).backward()
+        self.scaler_G.unscale_(self.G_optim)
+        self.scaler_G.step(self.G_optim)
+        self.scaler_G.update()
 
         # if use_ema is true, apply ema to the generator parameters
         if self.use_ema:
             self.update_average(self.G_shadow, self.G, self.ema_decay)
 
-        # return the loss value
-        return loss.item()
+        # return the loss value (kept on device, callers .item() at logging boundaries)
+        return loss.detach()
 
 
     def train(self, continue_train=False, data_path='maua/datasets/default_progan',
         dataloader=None, start_epoch=1, start_depth=1, until_depth=None, fade_in=0.5, save_freq=25,
         log_freq=5, num_epochs=50, learning_rates_dict={256: 5e-4, 512: 2.5e-4, 1024: 1e-4},
-        n_critic=1, loss="wgan-gp"):
+        n_critic=1, loss="wgan-gp", reuse_fakes=True):
         """
         Training function for ProGAN object
         :param continue_train: whether to continue training or not
@@ -212,15 +300,21 @@ class ProGAN(BaseModel):
         :param loss: the loss function to be used. Can either be a string =>
                         ["wgan-gp", "wgan", "lsgan", "lsgan-sig", "hinge", "rel-avg", "r1-reg"]
                      or an instance of GANLoss
+        :param reuse_fakes: reuse the fake batch generated for the discriminator step in the
+                            generator step, saving a full generator forward per batch. Only
+                            applies when n_critic is 1 and the loss is not r1-reg
         """
         self.model_names = ["G", "D"]
         self.n_critic = n_critic
         self.loss = self.setup_loss(loss)
+        self.reuse_fakes = reuse_fakes and n_critic == 1 and not isinstance(self.loss, R1Regularized)
 
-        os.makedirs(os.path.join(self.save_dir, "images"), exist_ok=True)
+        img_dir = os.path.join(self.save_dir, "images")
+        os.makedirs(img_dir, exist_ok=True)
 
         start_epoch = epoch = 1
         total_epochs = num_epochs * self.depth
+        total_epochs_display = num_epochs * (self.depth - 1)
         if continue_train:
             epoch = self.get_latest_network(start_epoch, max_epoch=total_epochs)
             start_depth = start_depth if start_depth != 1 else math.ceil(epoch / num_epochs)
@@ -228,84 +322,98 @@ class ProGAN(BaseModel):
 
         # create dataloader
         if dataloader is None and self.dataloader is None:
-            transforms = tv.transforms.Compose([tn.Resize(2**(self.depth + 1)), tn.ToTensor()])
+            transforms = tv.transforms.Compose([tn.Resize(1 << (self.depth + 1)), tn.ToTensor()])
             dataloader = ProGANDataLoader(data_path=data_path, transforms=transforms)
-        dataloader.generate_prescaled_dataset(sizes=list(map(lambda x: 2**(x+3), range(self.depth-1))))
+        dataloader.generate_prescaled_dataset(sizes=list(map(lambda x: 8 << x, range(self.depth-1))))
         self.dataloader = dataloader
         batches_dict = self.dataloader.get_batch_sizes(self)
         dataset_size = len(dataloader)
-        print('# training images = %d' % dataset_size)
+        if self.rank == 0: print('# training images = %d' % dataset_size)
 
         # create fixed_input for logging
-        fixed_input = th.randn(12, self.latent_size).to(self.device)
+        fixed_input = th.randn(12, self.latent_size, device=self.device)
 
-        print("Starting training on "+str(self.device))
+        if self.rank == 0: print("Starting training on "+str(self.device))
         global_time = time.time()
         for depth in range(start_depth, self.depth if until_depth is None else until_depth):
-            current_res = 2**(depth + 2)
-            print("Current resolution: %d x %d" % (current_res, current_res))
+            current_res = 4 << depth
+            if self.rank == 0: print("Current resolution: %d x %d" % (current_res, current_res))
 
             # update batch size and learning rate for scale
             dataloader.set_batch_size(current_res, batches_dict[current_res])
             total_batches = dataloader.batches()
+            log_interval = math.ceil(total_batches * log_freq)
             learning_rate = learning_rates_dict.get(current_res, self.default_rate)
             self.D_optim.lr = self.G_optim.lr = learning_rate
 
             for e in range(start_epoch if depth == start_depth else 1, num_epochs + 1):
                 start = time.time()
-                
+
+                # make sure each rank sees a different shard of the dataset this epoch
+                if getattr(dataloader, 'sampler', None) is not None:
+                    dataloader.sampler.set_epoch(epoch)
+
                 # calculate the value of alpha for fade-in effect
                 alpha = min(e / (num_epochs * fade_in), 1)
-                if log_freq < 1: print("Start of epoch: %s / %s \t Fade in: %s"%(epoch, total_epochs, alpha))
+                if log_freq < 1 and self.rank == 0:
+                    print("Start of epoch: %s / %s \t Fade in: %s"%(epoch, total_epochs, alpha))
 
-                loss_D, loss_G = 0, 0
+                loss_D, loss_G = th.zeros((), device=self.device), th.zeros((), device=self.device)
                 for i, batch in enumerate(dataloader, 1):
-                    images = batch.to(self.device)
-                    noise = th.randn(images.shape[0], self.latent_size).to(self.device)
-
-                    loss_D += self.optimize_D(noise, images, depth, alpha)
-                    loss_G += self.optimize_G(noise, images, depth, alpha)
-
-                    if i % math.ceil(total_batches * log_freq) == 0 and not (i == 0 or i == total_batches):
+                    if isinstance(batch, (list, tuple)):
+                        # pyramid dataloader serves (current res, prior res upsampled)
+                        batch = [b.to(self.device, non_blocking=True) for b in batch]
+                        images = batch[0]
+                    else:
+                        batch = images = batch.to(self.device, non_blocking=True)
+                    noise = th.randn(images.shape[0], self.latent_size, device=self.device)
+
+                    loss, fake_samples = self.optimize_D(noise, batch, depth, alpha)
+                    loss_D += loss
+                    loss_G += self.optimize_G(noise, images, depth, alpha, fake_samples)
+
+                    if self.rank == 0 and i % log_interval == 0 and not (i == 0 or i == total_batches):
                         elapsed = str(datetime.timedelta(seconds=time.time() - global_time))
                         print("Elapsed: [%s] Batch: %d / %d d_loss: %f  g_loss: %f" %
-                                (elapsed, i, total_batches, loss_D / math.ceil(total_batches*log_freq),
-                                loss_G / math.ceil(total_batches*log_freq)))
-                        loss_D, loss_G = 0, 0
+                                (elapsed, i, total_batches, loss_D.item() / log_interval,
+                                loss_G.item() / log_interval))
+                        loss_D, loss_G = th.zeros((), device=self.device), th.zeros((), device=self.device)
 
                         # create a grid of samples and save it
-                        gen_img_file = os.path.join(self.save_dir, "images", "sample_res%d_e%d_b%d" %
+                        gen_img_file = os.path.join(img_dir, "sample_res%d_e%d_b%d" %
                                                     (current_res, epoch, i) + ".png")
                         with th.no_grad():
                             self.create_grid(
                                 samples=self.G(fixed_input, depth, alpha),
-                                scale_factor=int(np.power(2, self.depth - depth - 2)),
+                                scale_factor=1 << max(self.depth - depth - 2, 0),
                                 img_file=gen_img_file,
                             )
 
-                if log_freq < 1: print("End of epoch:", epoch, "Took: ", time.time() - start, "sec")
+                if log_freq < 1 and self.rank == 0:
+                    print("End of epoch:", epoch, "Took: ", time.time() - start, "sec")
 
-                if log_freq >= 1 and epoch % log_freq == 0 or epoch == total_epochs:
+                if self.rank == 0 and (log_freq >= 1 and epoch % log_freq == 0 or epoch == total_epochs):
                     elapsed = str(datetime.timedelta(seconds=time.time() - global_time))
                     print("Elapsed: [%s] Epoch: %d / %d Fade in: %.02f d_loss: %f  g_loss: %f" %
-                          (elapsed, epoch, num_epochs*(self.depth-1), alpha, loss_D, loss_G))
+                          (elapsed, epoch, total_epochs_display, alpha, loss_D.item(), loss_G.item()))
                     # create a grid of samples and save it
-                    gen_img_file = os.path.join(self.save_dir, "images", "sample_res%d_e%d" %
+                    gen_img_file = os.path.join(img_dir, "sample_res%d_e%d" %
                                                 (current_res, epoch) + ".png")
                     with th.no_grad():
                         self.create_grid(
                             samples=self.G(fixed_input, depth, alpha),
-                            scale_factor=int(np.power(2, self.depth - depth)/4),
+                            scale_factor=1 << max(self.depth - depth - 2, 0),
                             img_file=gen_img_file,
                         )
 
-                if epoch % save_freq == 0 or epoch == total_epochs:
+                if self.rank == 0 and (epoch % save_freq == 0 or epoch == total_epochs):
                     self.save_networks(epoch)
 
                 epoch += 1
 
-        print("Training finished, took: ", datetime.timedelta(seconds=time.time() - global_time))
-        self.save_networks("final")
+        if self.rank == 0:
+            print("Training finished, took: ", datetime.timedelta(seconds=time.time() - global_time))
+            self.save_networks("final")
 
 
     # used to create grid of training images for logging
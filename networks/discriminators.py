@@ -3,6 +3,7 @@ import torch.nn as nn
 from torch.nn.functional import interpolate
 import numpy as np
 import functools, itertools
+from .losses import MODE_NONE, MODE_CAPTURE, MODE_LOSS
 
 
 # TODO add n_critic for training just like ProGAN allowing multiple D steps per G step
@@ -23,13 +24,13 @@ class MultiscaleDiscriminator(nn.Module):
         for scale in range(self.n_scales):
             discriminator = getattr(self, 'discriminator_%s'%(scale))
             for f in discriminator.feature_losses:
-                f.mode = 'capture'
+                f.mode = MODE_CAPTURE
 
     def capture_features(self):
         for scale in range(self.n_scales):
             discriminator = getattr(self, 'discriminator_%s'%(scale))
             for f in discriminator.feature_losses:
-                f.mode = 'loss'
+                f.mode = MODE_LOSS
 
     def feature_loss(self):
         feature_loss = 0
@@ -47,7 +48,7 @@ class MultiscaleDiscriminator(nn.Module):
             predictions = discriminator(downsampled_input)
             results += predictions
             for f in discriminator.feature_losses:
-                f.mode = 'None'
+                f.mode = MODE_NONE
         return results
 
 
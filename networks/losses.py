@@ -2,6 +2,10 @@ import torch as th
 import torch.autograd
 import numpy as np
 
+# phases for the feature loss modules below; plain integers so the comparison
+# in every forward pass skips Python string interning/hashing
+MODE_NONE, MODE_CAPTURE, MODE_LOSS = 0, 1, 2
+
 
 class NormalizeGradients(th.autograd.Function):
 
@@ -19,14 +23,14 @@ class ContentLoss(th.nn.Module):
     def __init__(self, strength=1.0, normalize=False):
         super(ContentLoss, self).__init__()
         self.crit = th.nn.MSELoss()
-        self.mode = 'None'
+        self.mode = MODE_NONE
         self.strength = strength
         self.normalize = normalize
 
     def forward(self, input):
-        if self.mode == 'capture':
+        if self.mode == MODE_CAPTURE:
             self.target = input.detach()
-        elif self.mode == 'loss':
+        elif self.mode == MODE_LOSS:
             self.loss = self.crit(input, self.target) * self.strength
         if self.normalize:
             input = NormalizeGradients.apply(input)
@@ -48,23 +52,27 @@ class StyleLoss(th.nn.Module):
         self.target = th.Tensor()
         self.gram = GramMatrix()
         self.crit = th.nn.MSELoss()
-        self.mode = 'None'
+        self.mode = MODE_NONE
         self.blend_weight = None
         self.strength = strength
         self.normalize = normalize
 
     def forward(self, input):
-        self.G = self.gram(input)
-        self.G = self.G.div(input.nelement())
-        if self.mode == 'capture':
-            if self.blend_weight == None:
-                self.target = self.G.detach()
-            elif self.target.nelement() == 0:
-                self.target = self.G.detach().mul(self.blend_weight)
-            else:
-                self.target = self.target.add(self.blend_weight, self.G.detach())
-        elif self.mode == 'loss':
-            self.loss = self.crit(self.G, self.target) * self.strength
+        # Gram entries sum activation products over H*W before the nelement division,
+        # which overflows fp16 with caffe-style 0-255 inputs — always compute the
+        # style statistics in fp32, even inside an autocast region
+        with th.cuda.amp.autocast(enabled=False):
+            self.G = self.gram(input.float())
+            self.G = self.G.div(input.nelement())
+            if self.mode == MODE_CAPTURE:
+                if self.blend_weight == None:
+                    self.target = self.G.detach()
+                elif self.target.nelement() == 0:
+                    self.target = self.G.detach().mul(self.blend_weight)
+                else:
+                    self.target = self.target.add(self.blend_weight, self.G.detach())
+            elif self.mode == MODE_LOSS:
+                self.loss = self.crit(self.G, self.target) * self.strength
         if self.normalize:
             input = NormalizeGradients.apply(input)
         return input
@@ -265,11 +273,12 @@ class R1Regularized(GANLoss):
         fake_loss = self.criterion(th.squeeze(f_preds), th.zeros(fake_samps.shape[0]).to(self.device))
 
         loss = (real_loss + fake_loss) / 2
-        loss.backward(retain_graph=True)
 
-        # R1 regularization
+        # R1 regularization (compute_grad2 keeps the graph, so the penalty is
+        # differentiable and both terms go through one combined backward — a DDP
+        # reducer finalizes per backward and would never sync a second one)
         reg = self.reg_param * self.compute_grad2(r_preds, real_samps).mean()
-        reg.backward()
+        (loss + reg).backward()
 
         # return final losses
         return loss
@@ -4,6 +4,7 @@ import torch.nn as nn
 import torch.optim as optim
 from PIL import Image
 from .utils import *
+from ..networks.losses import MODE_NONE, MODE_CAPTURE, MODE_LOSS
 
 class NeuralStyle(nn.Module):
     def __init__(self, content_image, style_images, init_image=None, output_image=None,
@@ -199,6 +200,12 @@ class NeuralStyle(nn.Module):
         return optimizer, loopVal
 
 
+    # flip all given loss modules to a new phase in a single pass
+    def set_loss_mode(self, losses, mode):
+        for mod in losses:
+            mod.mode = mode
+
+
     def maybe_print(self, num_calls, loss):
         if self.print_iter > 0 and num_calls[0] % self.print_iter == 0:
             print("Iteration " + str(num_calls[0]) + " / "+ str(self.num_iterations))
@@ -275,30 +282,28 @@ class NeuralStyle(nn.Module):
             content = preprocess(self.content_image, self.image_size)
             _, C, H, W = content.size()
             init = th.rand(C, H, W).mul(255).unsqueeze(0)
-        init = match_color(init, styles[0]).type(self.dtype)
-        content = match_color(content, styles[0]).type(self.dtype)
+        init = match_color(init, styles[0], out_dtype=self.dtype)
+        content = match_color(content, styles[0], out_dtype=self.dtype)
 
-        for i in self.style_losses:
-            i.mode = 'None'
-        for i in self.content_losses:
-            i.mode = 'capture'
+        self.set_loss_mode(self.style_losses, MODE_NONE)
+        self.set_loss_mode(self.content_losses, MODE_CAPTURE)
         print("Capturing content targets")
-        self.net(content)
-        for i in self.content_losses:
-            i.mode = 'None'
+        # the capture passes only store targets, no autograd graph needed
+        with th.no_grad():
+            self.net(content)
+        self.set_loss_mode(self.content_losses, MODE_NONE)
 
         for i, image in enumerate(styles):
             print("Capturing style target " + str(i+1))
             for j in self.style_losses:
-                j.mode = 'capture'
+                j.mode = MODE_CAPTURE
                 j.blend_weight = style_blend_weights[i]
-            self.net(image)
+            with th.no_grad():
+                self.net(image)
+
+        self.set_loss_mode(self.content_losses, MODE_LOSS)
+        self.set_loss_mode(self.style_losses, MODE_LOSS)
 
-        for i in self.content_losses:
-            i.mode = 'loss'
-        for i in self.style_losses:
-            i.mode = 'loss'
-        
         img = init.requires_grad_()
 
         num_calls = [0]
@@ -306,15 +311,12 @@ class NeuralStyle(nn.Module):
             num_calls[0] += 1
             optimizer.zero_grad()
             self.net(img)
-            loss = 0
 
-            for mod in self.content_losses:
-                loss += mod.loss
-            for mod in self.style_losses:
-                loss += mod.loss
+            losses = [mod.loss for mod in self.content_losses] + [mod.loss for mod in self.style_losses]
             if self.tv_weight > 0:
-                for mod in self.tv_losses:
-                    loss += mod.loss
+                losses += [mod.loss for mod in self.tv_losses]
+            # one fused reduction instead of a chain of zero-dim tensor adds
+            loss = th.stack(losses).sum()
             loss.backward()
 
             self.maybe_print(num_calls, loss)
@@ -6,6 +6,7 @@ import torch.optim as optim
 import torchvision.transforms.functional as F
 from PIL import Image
 from .utils import *
+from ..networks.losses import MODE_NONE, MODE_CAPTURE, MODE_LOSS
 
 
 class MultiscaleStyle(NeuralStyle):
@@ -50,40 +51,42 @@ class MultiscaleStyle(NeuralStyle):
             init = th.rand(C, H, W).mul(255).unsqueeze(0)
 
         scale_factor = (self.image_size / self.start_size)**(1.0/(self.steps - 1))
+        # closed-form schedule avoids the drift of repeatedly dividing by scale_factor
+        sizes = [round(self.start_size * scale_factor**i) for i in range(self.steps)]
         for scale in range(self.steps):
-            current_size = self.image_size
-            for s in range(self.steps - 1 - scale): current_size /= scale_factor
-            current_size = round(current_size)
+            current_size = sizes[scale]
             print("Styling at size %d x %d" % (current_size, current_size))
 
             styles, style_blend_weights = self.handle_style_images(self.style_images, current_size*self.style_scale)
             
-            init = nn.functional.interpolate(init, size=current_size)
-            init = match_color(init, styles[0]).type(self.dtype)
+            init = nn.functional.interpolate(init, size=current_size, mode='bilinear', align_corners=False)
+            init = match_color(init, styles[0], out_dtype=self.dtype)
 
-            content = nn.functional.interpolate(content_final, size=current_size)
-            content = match_color(content, styles[0]).type(self.dtype)
+            content = nn.functional.interpolate(content_final, size=current_size, mode='bilinear', align_corners=False)
+            content = match_color(content, styles[0], out_dtype=self.dtype)
 
-            for i in self.style_losses:
-                i.mode = 'None'
-            for i in self.content_losses:
-                i.mode = 'capture'
+            # run the VGG forwards in fp16 on tensor cores, the style/content losses are
+            # all autocast-safe elementwise + matmul ops
+            autocast = th.cuda.amp.autocast(enabled=self.gpu > -1, dtype=th.float16)
+
+            self.set_loss_mode(self.style_losses, MODE_NONE)
+            self.set_loss_mode(self.content_losses, MODE_CAPTURE)
             print("Capturing content targets")
-            self.net(content)
-            for i in self.content_losses:
-                i.mode = 'None'
+            # the capture passes only store targets, no autograd graph needed
+            with th.no_grad(), autocast:
+                self.net(content)
+            self.set_loss_mode(self.content_losses, MODE_NONE)
 
             for i, image in enumerate(styles):
                 print("Capturing style target " + str(i+1))
                 for j in self.style_losses:
-                    j.mode = 'capture'
+                    j.mode = MODE_CAPTURE
                     j.blend_weight = style_blend_weights[i]
-                self.net(image)
+                with th.no_grad(), autocast:
+                    self.net(image)
 
-            for i in self.content_losses:
-                i.mode = 'loss'
-            for i in self.style_losses:
-                i.mode = 'loss'
+            self.set_loss_mode(self.content_losses, MODE_LOSS)
+            self.set_loss_mode(self.style_losses, MODE_LOSS)
 
             img = init.requires_grad_()
 
@@ -91,16 +94,15 @@ class MultiscaleStyle(NeuralStyle):
             def feval():
                 num_calls[0] += 1
                 optimizer.zero_grad()
-                self.net(img)
-                loss = 0
+                with autocast:
+                    self.net(img)
 
-                for mod in self.content_losses:
-                    loss += mod.loss
-                for mod in self.style_losses:
-                    loss += mod.loss
+                losses = [mod.loss for mod in self.content_losses] + [mod.loss for mod in self.style_losses]
                 if self.tv_weight > 0:
-                    for mod in self.tv_losses:
-                        loss += mod.loss
+                    losses += [mod.loss for mod in self.tv_losses]
+                # one fused reduction instead of a chain of zero-dim tensor adds;
+                # L-BFGS has no GradScaler hook, backward through the fp32 loss directly
+                loss = th.stack([l.float() for l in losses]).sum()
                 loss.backward()
 
                 self.maybe_print(num_calls, loss)
@@ -111,7 +113,7 @@ class MultiscaleStyle(NeuralStyle):
             while num_calls[0] <= loopVal:
                 optimizer.step(feval)
 
-            init_image = match_color(img, styles[0]).type(self.dtype)
+            init_image = match_color(img, styles[0], out_dtype=self.dtype)
 
         ret = deprocess(img)
         if self.original_colors:
@@ -42,12 +42,14 @@ def original_colors(content, generated):
     return Image.merge('YCbCr', content_channels).convert('RGB')
 
 
-def match_color(target_img, source_img, mode='pca', eps=1e-5):
+def match_color(target_img, source_img, mode='pca', eps=1e-5, out_dtype=None):
     '''
     Matches the colour distribution of the target image to that of the source image
     using a linear transform.
     Images are expected to be tensors [0, 1] and are returned as such.
     Modes are chol, pca or sym for different choices of basis.
+    Pass out_dtype (a dtype or tensor type) to materialize the result in that
+    precision directly instead of converting the full tensor afterwards.
     '''
     bgr2rgb = tn.Lambda(lambda x: x[th.LongTensor([2,1,0])])
     denorm = tn.Normalize(mean=[-103.939, -116.779, -123.68], std=[1,1,1])
@@ -84,7 +86,11 @@ def match_color(target_img, source_img, mode='pca', eps=1e-5):
     matched_img = matched_img + mu_s
     matched_img[matched_img>1] = 1
     matched_img[matched_img<0] = 0
-    matched_img = matched_img * 255
-    norm = tn.Normalize(mean=[103.939, 116.779, 123.68], std=[1,1,1])
-    tensor = norm(bgr2rgb(tn.ToTensor()(matched_img))).unsqueeze(0)
-    return tensor
\ No newline at end of file
+    # fold the BGR flip and caffe-mean subtraction into the numpy array so the result
+    # is materialized as a tensor exactly once, already in the requested precision
+    matched_img = matched_img[:, :, ::-1] * 255 - np.asarray([103.939, 116.779, 123.68])
+    tensor = th.as_tensor(matched_img.transpose(2, 0, 1),
+                          dtype=getattr(out_dtype, 'dtype', out_dtype))
+    if out_dtype is not None:
+        tensor = tensor.type(out_dtype)  # only moves device for e.g. th.cuda.FloatTensor
+    return tensor.unsqueeze(0)
\ No newline at end of file